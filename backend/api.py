@@ -1,18 +1,79 @@
 import asyncio
 import logging
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Iterable, Optional
+import orjson
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi_cache import FastAPICache
+from fastapi_cache.decorator import cache
 
-from config import ALLOWED_ORIGINS
+from config import ALLOWED_ORIGINS, CACHE_EXPIRE_SECONDS
 from database import Database
-from ml_model import VehiclePricePredictor
+from ml_model import VehiclePricePredictor, train_model, predict_with_model, warm_up
 from scraper import AudiWestIslandScraper
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Audi West Island Inventory API", version="1.0.0")
+# naive datetimes from Mongo are UTC, so serialize them as "...Z"
+ORJSON_OPTIONS = (
+    orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+    | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _dumps(content) -> bytes:
+    return orjson.dumps(content, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also understands ObjectId and naive UTC datetimes."""
+
+    def render(self, content) -> bytes:
+        return _dumps(content)
+
+
+class RevalidateRoute(APIRoute):
+    """
+    Sends Cache-Control: no-cache on every response, so browsers revalidate
+    (ETag/304) instead of reusing a copy. fastapi-cache would otherwise send
+    max-age=<ttl>, and its server-side clear after a sync never reaches a
+    browser that is still holding the old stats.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def revalidating_handler(request: Request) -> Response:
+            response = await handler(request)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return revalidating_handler
+
+
+app = FastAPI(
+    title="Audi West Island Inventory API",
+    version="1.0.0",
+    default_response_class=MongoJSONResponse,
+)
+app.router.route_class = RevalidateRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,22 +83,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-db = Database()
+# opened by _connect_db() from the app lifespan, not at import: a spawned ML
+# worker that re-imports this module must not open its own pool or rerun index setup
+db: Optional[Database] = None
 predictor = VehiclePricePredictor()
-is_syncing = False
-sync_stage = ""
+
+
+def _connect_db():
+    global db
+    db = Database()
+
+
+def _new_ml_executor() -> ProcessPoolExecutor:
+    # training/prediction run here so CPU-bound work never blocks the event loop;
+    # one worker is enough since sync_lock already serializes pipeline runs.
+    # spawn rather than fork: forking would copy MongoClient's monitor threads and sockets.
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+
+ml_executor = _new_ml_executor()
+
+
+async def _run_in_ml_worker(fn, *args):
+    """Run fn in the ML worker process, replacing the pool if the worker has died."""
+    global ml_executor
+    try:
+        return await asyncio.get_running_loop().run_in_executor(ml_executor, fn, *args)
+    except BrokenProcessPool:
+        # e.g. OOM-killed mid-fit; without a fresh pool every later sync would fail too
+        logger.error("ML worker process died; starting a new one for the next run")
+        ml_executor.shutdown(wait=False)
+        ml_executor = _new_ml_executor()
+        raise
+
+
+@dataclass(slots=True)
+class SyncState:
+    is_syncing: bool = False
+    stage: str = ""
+    started_at: Optional[float] = None
+
+
+sync_state = SyncState()
+sync_lock = asyncio.Lock()
 
 
 def _load_model():
-    """Try loading a previously trained model from MongoDB."""
+    """Try loading a previously trained model from MongoDB. Called once from the app lifespan."""
     global predictor
     try:
-        model_doc = db.db["ml_models"].find_one(
-            {"type": "price_predictor"},
-            sort=[("timestamp", -1)],
-        )
-        if model_doc and "model_data" in model_doc:
-            predictor.deserialize(model_doc["model_data"])
+        model_stream = db.load_model()
+        if model_stream is not None:
+            predictor.deserialize(model_stream)
             logger.info("ML model loaded from database.")
         else:
             logger.info("No saved ML model found. Training required.")
@@ -45,19 +142,88 @@ def _load_model():
         logger.error(f"Error loading model: {e}")
 
 
-_load_model()
+# GET responses that only change when a sync runs
+INVENTORY_CACHE_NAMESPACE = "inventory"
+
+
+# ETag/Last-Modified for uncached inventory GETs, re-read at most once a minute.
+# Derived from a generation counter in Mongo that _invalidate_cache() bumps after
+# the sync write and again after predicted prices land, so it moves whenever the
+# bodies do, in every API worker.
+INVENTORY_VERSION_TTL = 60
+_inventory_version: Optional[dict] = None
+_inventory_version_expires = 0.0
+
+
+def _set_inventory_version(generation: Optional[dict]) -> dict:
+    global _inventory_version, _inventory_version_expires
+    generation = generation or {}
+    # no-cache: validators alone would let browsers cache the 200 heuristically
+    headers = {"ETag": f'"{generation.get("generation", 0)}"', "Cache-Control": "no-cache"}
+    if updated_at := generation.get("updated_at"):
+        headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    _inventory_version = headers
+    _inventory_version_expires = time.monotonic() + INVENTORY_VERSION_TTL
+    return headers
+
+
+async def _invalidate_cache():
+    try:
+        _set_inventory_version(await asyncio.to_thread(db.bump_inventory_generation))
+    except Exception as e:
+        logger.error(f"Error bumping inventory generation: {e}")
+    try:
+        await FastAPICache.clear(namespace=INVENTORY_CACHE_NAMESPACE)
+    except Exception as e:
+        logger.error(f"Error clearing response cache: {e}")
+
+
+def inventory_version() -> dict:
+    """Validator headers for the current inventory generation."""
+    if _inventory_version is None or time.monotonic() >= _inventory_version_expires:
+        return _set_inventory_version(db.get_inventory_generation())
+    return _inventory_version
+
+
+def _not_modified(request: Request, version: dict) -> Optional[Response]:
+    if request.headers.get("if-none-match") == version["ETag"]:
+        return Response(status_code=304, headers=version)
+    return None
+
+
+def _stream_vehicle_list(cursor: Iterable[dict], **extra):
+    """
+    Stream {"vehicles": [...], "total": N, **extra} straight from a Mongo cursor
+    so the full result set is never held in memory. "total" goes last because
+    it is only known once the cursor is drained.
+    """
+    yield b'{"vehicles":['
+    total = 0
+    for doc in cursor:
+        yield (b"," if total else b"") + _dumps(doc)
+        total += 1
+    yield b"]," + _dumps({"total": total, **extra})[1:]
 
 
 # ── Vehicle endpoints ────────────────────────────────────────────────
 
 @app.get("/vehicles", tags=["Vehicles"])
-async def get_vehicles(include_removed: bool = Query(False)):
-    vehicles = db.get_all_vehicles(include_removed=include_removed)
-    return {"total": len(vehicles), "vehicles": vehicles}
+async def get_vehicles(
+    request: Request,
+    include_removed: bool = Query(False),
+    version: dict = Depends(inventory_version),
+):
+    if not_modified := _not_modified(request, version):
+        return not_modified
+    cursor = db.iter_all_vehicles(include_removed=include_removed)
+    return StreamingResponse(
+        _stream_vehicle_list(cursor), media_type="application/json", headers=version,
+    )
 
 
 @app.get("/vehicles/search", tags=["Vehicles"])
 async def search_vehicles(
+    request: Request,
     make: Optional[str] = Query(None),
     model: Optional[str] = Query(None),
     year_min: Optional[int] = Query(None),
@@ -66,8 +232,11 @@ async def search_vehicles(
     price_max: Optional[int] = Query(None),
     fuel_type: Optional[str] = Query(None),
     transmission: Optional[str] = Query(None),
+    version: dict = Depends(inventory_version),
 ):
-    vehicles = db.search_vehicles(
+    if not_modified := _not_modified(request, version):
+        return not_modified
+    cursor = db.iter_search_vehicles(
         make=make, model=model,
         year_min=year_min, year_max=year_max,
         price_min=price_min, price_max=price_max,
@@ -81,10 +250,15 @@ async def search_vehicles(
             "fuel_type": fuel_type, "transmission": transmission,
         }.items() if v is not None
     }
-    return {"total": len(vehicles), "filters_applied": applied, "vehicles": vehicles}
+    return StreamingResponse(
+        _stream_vehicle_list(cursor, filters_applied=applied),
+        media_type="application/json",
+        headers=version,
+    )
 
 
 @app.get("/vehicles/stats", tags=["Vehicles"])
+@cache(expire=CACHE_EXPIRE_SECONDS, namespace=INVENTORY_CACHE_NAMESPACE)
 async def get_inventory_stats():
     return db.get_inventory_stats()
 
@@ -94,7 +268,9 @@ async def get_vehicle(vehicle_id: str):
     vehicle = db.get_vehicle_by_id(vehicle_id)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    return vehicle
+    # Mongo documents are returned as MongoJSONResponse so their datetimes get the
+    # same "...Z" encoding as the streamed lists instead of going through jsonable_encoder
+    return MongoJSONResponse(vehicle)
 
 
 @app.get("/vehicles/{vehicle_id}/predict", tags=["ML Predictions"])
@@ -117,12 +293,12 @@ async def get_vehicle_price_history(vehicle_id: str):
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     history = db.get_price_history(vehicle.get("vin", vehicle_id))
-    return {
+    return MongoJSONResponse({
         "vin": vehicle.get("vin"),
         "title": vehicle.get("title"),
         "current_price": vehicle.get("price"),
         "history": history,
-    }
+    })
 
 
 # ── Sync endpoints ───────────────────────────────────────────────────
@@ -135,85 +311,101 @@ async def get_sync_status():
     if not last_sync:
         return {"status": "never_synced", "message": "No sync yet.", "last_sync": None, "history": []}
 
-    for s in history:
-        if "timestamp" in s:
-            s["timestamp"] = s["timestamp"].isoformat() + "Z"
-    if "timestamp" in last_sync:
-        last_sync["timestamp"] = last_sync["timestamp"].isoformat() + "Z"
+    # returned directly so the datetimes reach orjson instead of jsonable_encoder
+    return MongoJSONResponse({"status": "completed", "last_sync": last_sync, "history": history})
 
-    return {"status": "completed", "last_sync": last_sync, "history": history}
 
+async def _claim_sync() -> bool:
+    """Atomically mark a sync as running. Returns False if one already is."""
+    async with sync_lock:
+        if sync_state.is_syncing:
+            return False
+        sync_state.is_syncing = True
+        sync_state.stage = "scraping"
+        sync_state.started_at = time.time()
+        return True
 
-async def _run_sync_pipeline(source: str = "manual"):
-    """Full pipeline: scrape -> sync -> retrain -> predict -> save model."""
-    global is_syncing, predictor, sync_stage
-    is_syncing = True
-    sync_stage = "scraping"
 
+async def _run_sync_pipeline(source: str = "manual"):
+    """
+    Full pipeline: scrape -> sync -> retrain -> predict -> save model.
+    Callers must win _claim_sync() first; the claim is released when this returns.
+    """
     try:
-        # 1) Scrape
+        # 1) Scrape, while the ML worker process spawns and imports
+        #    pandas/sklearn in the background so training can start right away
         logger.info("Pipeline: Starting scrape...")
         scraper = AudiWestIslandScraper()
-        vehicles = await scraper.scrape_inventory()
+        # return_exceptions: a failed warm-up must neither fail the sync nor leave
+        # the scrape running orphaned after the claim is released
+        vehicles, warm_up_result = await asyncio.gather(
+            scraper.scrape_inventory(),
+            _run_in_ml_worker(warm_up),
+            return_exceptions=True,
+        )
+        if isinstance(warm_up_result, BaseException):
+            logger.warning(f"Pipeline: ML worker warm-up failed: {warm_up_result}")
+        if isinstance(vehicles, BaseException):
+            raise vehicles
         logger.info(f"Pipeline: Scraped {len(vehicles)} vehicles")
 
         # 2) Sync to DB (run in thread to avoid blocking event loop)
-        sync_stage = "syncing"
+        sync_state.stage = "syncing"
         logger.info("Pipeline: Syncing to database...")
         sync_result = await asyncio.to_thread(db.sync_vehicles, vehicles, source)
         logger.info(f"Pipeline: Sync complete - {sync_result}")
+        await _invalidate_cache()
 
-        # 3) Retrain (run in thread — CPU-heavy)
-        sync_stage = "training"
+        # 3) Retrain (in the worker process — CPU-heavy)
+        sync_state.stage = "training"
         logger.info("Pipeline: Retraining ML model...")
         active_vehicles = await asyncio.to_thread(db.get_active_vehicles)
-        training_result = await asyncio.to_thread(predictor.train, active_vehicles)
+        training_result, model_data = await _run_in_ml_worker(train_model, active_vehicles)
+        if model_data:
+            predictor.deserialize(model_data)
         logger.info(f"Pipeline: Training complete - {training_result}")
 
-        # 4) Predict + persist (run in thread)
-        sync_stage = "predicting"
+        # 4) Predict (in the worker process) + persist
+        sync_state.stage = "predicting"
         if predictor.is_trained:
-            predictions = await asyncio.to_thread(predictor.predict_batch, active_vehicles)
+            # keep predicting with the previous model if this retrain was skipped
+            model_data = model_data or predictor.serialize()
+            predictions = await _run_in_ml_worker(predict_with_model, model_data, active_vehicles)
             await asyncio.to_thread(db.update_predicted_prices, predictions)
             logger.info(f"Pipeline: Updated {len(predictions)} predictions")
-
-            model_data = predictor.serialize()
-            db.db["ml_models"].update_one(
-                {"type": "price_predictor"},
-                {"$set": {
-                    "type": "price_predictor",
-                    "model_data": model_data,
-                    "timestamp": predictor.training_timestamp,
-                    "metrics": predictor.metrics,
-                    "best_model": predictor.best_model_name,
-                }},
-                upsert=True,
+            await _invalidate_cache()
+
+            await asyncio.to_thread(
+                db.save_model,
+                model_data,
+                timestamp=predictor.training_timestamp,
+                metrics=predictor.metrics,
+                best_model=predictor.best_model_name,
             )
             logger.info("Pipeline: Model saved to database")
 
-        sync_stage = "done"
+        sync_state.stage = "done"
         return {
             "scrape_result": {"vehicles_found": len(vehicles)},
             "sync_result": sync_result,
             "training_result": training_result,
         }
     except Exception as e:
-        sync_stage = f"error: {e}"
+        sync_state.stage = f"error: {e}"
         logger.error(f"Pipeline error: {e}")
         raise
     finally:
-        is_syncing = False
+        sync_state.is_syncing = False
 
 
 @app.get("/sync-progress", tags=["Sync"])
 async def get_sync_progress():
-    return {"is_syncing": is_syncing, "stage": sync_stage}
+    return asdict(sync_state)
 
 
 @app.post("/trigger-sync", tags=["Sync"])
 async def trigger_sync(background_tasks: BackgroundTasks):
-    global is_syncing
-    if is_syncing:
+    if not await _claim_sync():
         return {"status": "already_running", "message": "A sync is already in progress."}
     background_tasks.add_task(_run_sync_pipeline)
     return {"status": "started", "message": "Sync pipeline started in background. Check /sync-status for progress."}
@@ -222,11 +414,10 @@ async def trigger_sync(background_tasks: BackgroundTasks):
 @app.post("/trigger-sync-blocking", tags=["Sync"])
 async def trigger_sync_blocking():
     """Blocking sync — waits until complete. Used by n8n workflow."""
-    global is_syncing
-    if is_syncing:
+    if not await _claim_sync():
         raise HTTPException(status_code=409, detail="A sync is already in progress.")
     result = await _run_sync_pipeline()
-    return {"status": "completed", "result": result}
+    return MongoJSONResponse({"status": "completed", "result": result})
 
 
 # ── ML endpoints ─────────────────────────────────────────────────────
@@ -237,22 +428,23 @@ async def get_model_summary():
 
 
 @app.get("/ml/predictions", tags=["ML Predictions"])
+@cache(expire=CACHE_EXPIRE_SECONDS, namespace=INVENTORY_CACHE_NAMESPACE)
 async def get_all_predictions():
     if not predictor.is_trained:
         raise HTTPException(status_code=503, detail="ML model not trained yet.")
 
     vehicles = db.get_active_vehicles()
-    results = []
-    for v in vehicles:
-        pred = predictor.predict(v)
-        if pred:
-            results.append({
-                "vin": v.get("vin"),
-                "title": v.get("title"),
-                "actual_price": v.get("price"),
-                "predicted_price": pred["predicted_price"],
-                "price_difference": pred["price_difference"],
-            })
+    preds = predictor.predict_batch(vehicles)
+    results = [
+        {
+            "vin": v["vin"],
+            "title": v.get("title"),
+            "actual_price": v.get("price"),
+            "predicted_price": preds[v["vin"]],
+            "price_difference": preds[v["vin"]] - v["price"] if v.get("price") else None,
+        }
+        for v in vehicles if v.get("vin") in preds
+    ]
 
     return {"model_used": predictor.best_model_name, "total_predictions": len(results), "predictions": results}
 
@@ -263,5 +455,5 @@ async def health_check():
         "status": "healthy",
         "database": "connected",
         "ml_model_trained": predictor.is_trained,
-        "is_syncing": is_syncing,
+        "is_syncing": sync_state.is_syncing,
     }
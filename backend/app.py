@@ -2,9 +2,17 @@ import logging
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-
-from api import app, _run_sync_pipeline, db, predictor, _load_model
-from config import SYNC_INTERVAL_HOURS, API_HOST, API_PORT, TARGET_URL
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from redis import asyncio as aioredis
+
+import api
+from api import app, _claim_sync, _run_sync_pipeline, _connect_db, _load_model, MongoJSONResponse
+from config import (
+    SYNC_INTERVAL_HOURS, API_HOST, API_PORT, API_WORKERS, TARGET_URL,
+    REDIS_URL, CACHE_PREFIX,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,6 +23,9 @@ scheduler = AsyncIOScheduler()
 async def scheduled_sync():
     """Runs every 24 hours to keep inventory fresh."""
     logger.info("=== Automated 24-hour sync triggered ===")
+    if not await _claim_sync():
+        logger.info("Automated sync skipped: a sync is already in progress.")
+        return
     try:
         result = await _run_sync_pipeline(source="scheduled")
         logger.info(f"Automated sync complete: {result}")
@@ -26,8 +37,17 @@ async def scheduled_sync():
 async def lifespan(app):
     logger.info("Starting Audi West Island Inventory System...")
 
+    _connect_db()
     _load_model()
 
+    if REDIS_URL:
+        redis = aioredis.from_url(REDIS_URL)
+        FastAPICache.init(RedisBackend(redis), prefix=CACHE_PREFIX)
+        logger.info("Response cache: Redis")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix=CACHE_PREFIX)
+        logger.info("Response cache: in-memory (REDIS_URL not set)")
+
     scheduler.add_job(
         scheduled_sync,
         trigger=IntervalTrigger(hours=SYNC_INTERVAL_HOURS),
@@ -42,7 +62,9 @@ async def lifespan(app):
 
     logger.info("Shutting down...")
     scheduler.shutdown()
-    db.close()
+    # read through the module: the pool is replaced if its worker dies
+    api.ml_executor.shutdown(cancel_futures=True)
+    api.db.close()
 
 
 app.router.lifespan_context = lifespan
@@ -71,19 +93,20 @@ async def get_automation_log():
             "trigger": str(job.trigger),
         })
 
-    history = db.get_sync_history(limit=10, source="scheduled")
-    for s in history:
-        if "timestamp" in s:
-            s["timestamp"] = s["timestamp"].isoformat() + "Z"
+    history = api.db.get_sync_history(limit=10, source="scheduled")
 
-    return {
+    return MongoJSONResponse({
         "scheduler_running": scheduler.running,
         "sync_interval_hours": SYNC_INTERVAL_HOURS,
         "configured_jobs": jobs,
         "sync_history": history,
-    }
+    })
 
 
 if __name__ == "__main__":
     import uvicorn
+    # pass the app object so uvicorn doesn't re-import this module as "app";
+    # main.py is the entry point that honours API_WORKERS
+    if API_WORKERS > 1:
+        logger.warning("API_WORKERS is ignored when running app.py directly; use main.py")
     uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -6,6 +6,15 @@ load_dotenv()
 # MongoDB
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "audi_west_island")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "5"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zstd,snappy")
+
+# Redis response cache (falls back to in-memory when unset)
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_PREFIX = "audi-cache"
+CACHE_EXPIRE_SECONDS = int(os.getenv("CACHE_EXPIRE_SECONDS", "3600"))
 
 # Scraper
 TARGET_URL = "https://www.audiwestisland.com/fr/inventaire/occasion/"
@@ -26,6 +35,9 @@ CV_FOLDS = 5
 # API
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8000"))
+# every worker runs its own scheduler and sync state, so keep this at 1
+# unless the scheduled sync is moved out of the API process
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 ALLOWED_ORIGINS = os.getenv(
     "ALLOWED_ORIGINS",
     "http://localhost:5173,http://localhost:3000"
@@ -1,24 +1,69 @@
 import logging
+import re
 from datetime import datetime, timezone
 from typing import Optional
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateMany, UpdateOne
 from pymongo.collection import Collection
+from pymongo.cursor import Cursor
 from bson import ObjectId
+from gridfs import GridFS
 
-from config import MONGODB_URI, MONGODB_DB_NAME
+from config import (
+    MONGODB_URI, MONGODB_DB_NAME, MODEL_COLLECTION,
+    MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE,
+    MONGODB_MAX_IDLE_TIME_MS, MONGODB_COMPRESSORS,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BULK_BATCH_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+# fields diffed between a scraped vehicle and its stored doc
+COMPARE_FIELDS = [
+    "price", "mileage", "title", "fuel_type",
+    "transmission", "exterior_color", "interior_color",
+    "drivetrain", "engine", "body_style", "trim",
+]
+
+# lowercased copies stored as <field>_lc so search can do exact, index-backed matches
+NORMALIZED_FIELDS = ["make", "model", "fuel_type", "transmission"]
+# keep the internal *_lc copies out of API responses
+HIDDEN_FIELDS = {f"{field}_lc": 0 for field in NORMALIZED_FIELDS}
+PUBLIC_PROJECTION = {"_id": 0, **HIDDEN_FIELDS}
+
+
+def _normalized(fields: dict) -> dict:
+    return {
+        f"{field}_lc": fields[field].lower()
+        for field in NORMALIZED_FIELDS
+        if isinstance(fields.get(field), str)
+    }
+
 
 class Database:
     def __init__(self):
-        self.client = MongoClient(MONGODB_URI)
+        self.client = MongoClient(
+            MONGODB_URI,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+            compressors=MONGODB_COMPRESSORS,
+            retryWrites=True,
+            w="majority",
+        )
         self.db = self.client[MONGODB_DB_NAME]
         self.vehicles: Collection = self.db["vehicles"]
         self.sync_logs: Collection = self.db["sync_logs"]
         self.price_history: Collection = self.db["price_history"]
+        # single-doc snapshot, refreshed on every sync
+        self.inventory_stats: Collection = self.db["inventory_stats_cache"]
+        self.predictions_staging: Collection = self.db["predictions_staging"]
+        self.models: Collection = self.db[MODEL_COLLECTION]
+        self.model_files = GridFS(self.db, collection=f"{MODEL_COLLECTION}_fs")
         self._ensure_indexes()
+        self._backfill_normalized_fields()
 
     def _ensure_indexes(self):
         self.vehicles.create_index([("vin", ASCENDING)], unique=True)
@@ -26,17 +71,38 @@ class Database:
         self.vehicles.create_index([("price", ASCENDING)])
         self.vehicles.create_index([("year", DESCENDING)])
         self.vehicles.create_index([("make", ASCENDING), ("model", ASCENDING)])
+        # ESR order: status/make equality, model prefix, price sort, year range
+        self.vehicles.create_index([
+            ("status", ASCENDING), ("make_lc", ASCENDING), ("model_lc", ASCENDING),
+            ("price", ASCENDING), ("year", DESCENDING),
+        ])
+        self.vehicles.create_index([("status", ASCENDING), ("date_scraped", DESCENDING)])
         self.sync_logs.create_index([("timestamp", DESCENDING)])
         self.price_history.create_index(
             [("vin", ASCENDING), ("timestamp", DESCENDING)]
         )
 
+    def _backfill_normalized_fields(self):
+        """Populate *_lc fields on docs stored before they existed (lowercased in
+        Python since Mongo's $toLower only handles ASCII, e.g. "Électrique")."""
+        projection = {field: 1 for field in NORMALIZED_FIELDS}
+        docs = self.vehicles.find({"make_lc": {"$exists": False}}, projection)
+        ops = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": fields})
+            for doc in docs if (fields := _normalized(doc))
+        ]
+        for start in range(0, len(ops), BULK_BATCH_SIZE):
+            self.vehicles.bulk_write(ops[start:start + BULK_BATCH_SIZE], ordered=False)
+
     def sync_vehicles(self, scraped_vehicles: list[dict], source: str = "manual") -> dict:
         """
         Compare scraped data with DB:
         - Insert new vehicles (VIN not in DB)
         - Update changed fields on existing vehicles
         - Mark vehicles missing from scrape as inactive
+
+        Existing docs are fetched in one query and diffed locally, then all
+        writes go out as a single unordered bulk_write.
         """
         timestamp = datetime.now(timezone.utc)
         scraped_vins = set()
@@ -44,6 +110,17 @@ class Database:
         added_details = []
         updated_details = []
         removed_details = []
+        ops = []
+        unchanged_vins = []
+        price_events = []
+
+        vins = [v["vin"] for v in scraped_vehicles if v.get("vin")]
+        projection = {field: 1 for field in COMPARE_FIELDS}
+        projection.update({"vin": 1, "_id": 0})
+        existing_by_vin = {
+            doc["vin"]: doc
+            for doc in self.vehicles.find({"vin": {"$in": vins}}, projection)
+        }
 
         for vehicle in scraped_vehicles:
             vin = vehicle.get("vin")
@@ -51,25 +128,26 @@ class Database:
                 continue
 
             scraped_vins.add(vin)
-            existing = self.vehicles.find_one({"vin": vin})
+            existing = existing_by_vin.get(vin)
 
             if existing is None:
                 vehicle["date_scraped"] = timestamp
                 vehicle["last_seen"] = timestamp
                 vehicle["status"] = "active"
                 vehicle["created_at"] = timestamp
-                self.vehicles.insert_one(vehicle)
+                vehicle.update(_normalized(vehicle))
+                ops.append(UpdateOne({"vin": vin}, {"$setOnInsert": vehicle}, upsert=True))
                 added += 1
                 added_details.append({"title": vehicle.get("title", vin)})
                 logger.info(f"Added new vehicle: {vin}")
 
                 if vehicle.get("price"):
-                    self._record_price(vin, vehicle["price"], timestamp)
+                    price_events.append({"vin": vin, "price": vehicle["price"], "timestamp": timestamp})
             else:
                 changes = self._detect_changes(existing, vehicle)
                 if changes:
                     if "price" in changes and vehicle.get("price"):
-                        self._record_price(vin, vehicle["price"], timestamp)
+                        price_events.append({"vin": vin, "price": vehicle["price"], "timestamp": timestamp})
 
                     # Track what changed for this vehicle
                     change_info = {"title": existing.get("title", vin), "fields": {}}
@@ -85,26 +163,42 @@ class Database:
 
                     changes["last_seen"] = timestamp
                     changes["status"] = "active"
-                    self.vehicles.update_one({"vin": vin}, {"$set": changes})
+                    changes.update(_normalized(changes))
+                    ops.append(UpdateOne({"vin": vin}, {"$set": changes}, upsert=True))
                     updated += 1
                     logger.info(f"Updated vehicle {vin}: {list(changes.keys())}")
                 else:
-                    self.vehicles.update_one(
-                        {"vin": vin},
-                        {"$set": {"last_seen": timestamp, "status": "active"}}
-                    )
-                    unchanged += 1
-
-        # mark anything we didn't see this scrape as removed
-        for db_vehicle in self.vehicles.find({"status": "active"}):
-            if db_vehicle["vin"] not in scraped_vins:
-                self.vehicles.update_one(
-                    {"vin": db_vehicle["vin"]},
-                    {"$set": {"status": "removed", "removed_at": timestamp}}
-                )
-                removed += 1
-                removed_details.append({"title": db_vehicle.get("title", db_vehicle["vin"])})
-                logger.info(f"Marked vehicle as removed: {db_vehicle['vin']}")
+                    unchanged_vins.append(vin)
+
+        # mark anything we didn't see this scrape as removed; the set difference
+        # is done server-side so only the missing vehicles' vin/title come back
+        removed_vins = []
+        missing = self.vehicles.find(
+            {"status": "active", "vin": {"$nin": list(scraped_vins)}},
+            {"vin": 1, "title": 1, "_id": 0},
+        ).batch_size(1000)
+        for db_vehicle in missing:
+            removed_vins.append(db_vehicle["vin"])
+            removed_details.append({"title": db_vehicle.get("title", db_vehicle["vin"])})
+            logger.info(f"Marked vehicle as removed: {db_vehicle['vin']}")
+        removed = len(removed_vins)
+        unchanged = len(unchanged_vins)
+
+        # unchanged vehicles only need last_seen bumped, so one op covers them all
+        if unchanged_vins:
+            ops.append(UpdateMany(
+                {"vin": {"$in": unchanged_vins}},
+                {"$set": {"last_seen": timestamp, "status": "active"}}
+            ))
+        if ops:
+            self.vehicles.bulk_write(ops, ordered=False)
+        if removed_vins:
+            self.vehicles.update_many(
+                {"vin": {"$in": removed_vins}},
+                {"$set": {"status": "removed", "removed_at": timestamp}}
+            )
+        if price_events:
+            self.price_history.insert_many(price_events, ordered=False)
 
         sync_summary = {
             "timestamp": timestamp,
@@ -119,49 +213,48 @@ class Database:
             "updated_details": updated_details,
             "removed_details": removed_details,
         }
-        self.sync_logs.insert_one(sync_summary)
+        # insert a copy: insert_one would add an ObjectId _id to the summary we return
+        self.sync_logs.insert_one(dict(sync_summary))
+        # inventory only changes here, so stats are computed once per sync
+        self.refresh_inventory_stats()
         logger.info(f"Sync complete: {sync_summary}")
         return sync_summary
 
     def _detect_changes(self, existing: dict, scraped: dict) -> dict:
         changes = {}
-        compare_fields = [
-            "price", "mileage", "title", "fuel_type",
-            "transmission", "exterior_color", "interior_color",
-            "drivetrain", "engine", "body_style", "trim",
-        ]
-        for field in compare_fields:
+        for field in COMPARE_FIELDS:
             new_val = scraped.get(field)
             old_val = existing.get(field)
             if new_val is not None and new_val != old_val:
                 changes[field] = new_val
         return changes
 
-    def _record_price(self, vin: str, price: int, timestamp: datetime):
-        self.price_history.insert_one({
-            "vin": vin, "price": price, "timestamp": timestamp,
-        })
-
     # ── Queries ───────────────────────────────────────────────────────
 
     def get_active_vehicles(self) -> list[dict]:
         return list(
-            self.vehicles.find({"status": "active"}, {"_id": 0})
+            self.vehicles.find({"status": "active"}, PUBLIC_PROJECTION)
             .sort("date_scraped", DESCENDING)
         )
 
     def get_all_vehicles(self, include_removed=False) -> list[dict]:
+        return list(self.iter_all_vehicles(include_removed=include_removed))
+
+    def iter_all_vehicles(self, include_removed=False) -> Cursor:
+        """Lazy cursor over vehicles, fetched from the server in batches."""
         query = {} if include_removed else {"status": "active"}
-        return list(
-            self.vehicles.find(query, {"_id": 0}).sort("date_scraped", DESCENDING)
+        return (
+            self.vehicles.find(query, PUBLIC_PROJECTION)
+            .sort("date_scraped", DESCENDING)
+            .batch_size(STREAM_BATCH_SIZE)
         )
 
     def get_vehicle_by_vin(self, vin: str) -> Optional[dict]:
-        return self.vehicles.find_one({"vin": vin}, {"_id": 0})
+        return self.vehicles.find_one({"vin": vin}, PUBLIC_PROJECTION)
 
     def get_vehicle_by_id(self, vehicle_id: str) -> Optional[dict]:
         try:
-            vehicle = self.vehicles.find_one({"_id": ObjectId(vehicle_id)})
+            vehicle = self.vehicles.find_one({"_id": ObjectId(vehicle_id)}, HIDDEN_FIELDS)
             if vehicle:
                 vehicle["_id"] = str(vehicle["_id"])
             return vehicle
@@ -171,11 +264,22 @@ class Database:
     def search_vehicles(self, make=None, model=None, year_min=None,
                         year_max=None, price_min=None, price_max=None,
                         fuel_type=None, transmission=None) -> list[dict]:
+        return list(self.iter_search_vehicles(
+            make=make, model=model, year_min=year_min, year_max=year_max,
+            price_min=price_min, price_max=price_max,
+            fuel_type=fuel_type, transmission=transmission,
+        ))
+
+    def iter_search_vehicles(self, make=None, model=None, year_min=None,
+                             year_max=None, price_min=None, price_max=None,
+                             fuel_type=None, transmission=None) -> Cursor:
         query = {"status": "active"}
+        # exact/prefix matches on the lowercased copies use index bounds;
+        # a case-insensitive or unanchored $regex would not
         if make:
-            query["make"] = {"$regex": make, "$options": "i"}
+            query["make_lc"] = make.lower()
         if model:
-            query["model"] = {"$regex": model, "$options": "i"}
+            query["model_lc"] = {"$regex": f"^{re.escape(model.lower())}"}
         if year_min:
             query.setdefault("year", {})["$gte"] = year_min
         if year_max:
@@ -185,11 +289,15 @@ class Database:
         if price_max:
             query.setdefault("price", {})["$lte"] = price_max
         if fuel_type:
-            query["fuel_type"] = {"$regex": fuel_type, "$options": "i"}
+            query["fuel_type_lc"] = fuel_type.lower()
         if transmission:
-            query["transmission"] = {"$regex": transmission, "$options": "i"}
+            query["transmission_lc"] = transmission.lower()
 
-        return list(self.vehicles.find(query, {"_id": 0}).sort("price", ASCENDING))
+        return (
+            self.vehicles.find(query, PUBLIC_PROJECTION)
+            .sort("price", ASCENDING)
+            .batch_size(STREAM_BATCH_SIZE)
+        )
 
     def get_price_history(self, vin: str) -> list[dict]:
         return list(
@@ -210,8 +318,59 @@ class Database:
     # ── Stats ─────────────────────────────────────────────────────────
 
     def get_inventory_stats(self) -> dict:
-        active = list(self.vehicles.find({"status": "active"}))
-        if not active:
+        """Serve the stats snapshot written by the last sync (computed on first use)."""
+        stats = self.inventory_stats.find_one({"_id": "current"}, {"_id": 0})
+        if stats is None:
+            stats = self.refresh_inventory_stats()
+        return stats
+
+    def refresh_inventory_stats(self) -> dict:
+        stats = self.compute_inventory_stats()
+        self.inventory_stats.replace_one({"_id": "current"}, stats, upsert=True)
+        return stats
+
+    def bump_inventory_generation(self) -> dict:
+        """
+        Advance the inventory generation that API ETags are derived from. Kept in
+        Mongo so every API worker sees a change made by whichever one ran the sync.
+        """
+        return self.inventory_stats.find_one_and_update(
+            {"_id": "generation"},
+            {"$inc": {"generation": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def get_inventory_generation(self) -> Optional[dict]:
+        return self.inventory_stats.find_one({"_id": "generation"}, {"_id": 0})
+
+    def compute_inventory_stats(self) -> dict:
+        """Compute inventory stats server-side in a single $facet aggregation."""
+        # zero/missing values are skipped, same as the old Python-side filter
+        def positive(field):
+            return {"$cond": [{"$gt": [f"${field}", 0]}, f"${field}", None]}
+
+        result = next(self.vehicles.aggregate([
+            {"$match": {"status": "active"}},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "total_active": {"$sum": 1},
+                    "avg_price": {"$avg": positive("price")},
+                    "avg_mileage": {"$avg": positive("mileage")},
+                    "min_price": {"$min": positive("price")},
+                    "max_price": {"$max": positive("price")},
+                    "min_year": {"$min": positive("year")},
+                    "max_year": {"$max": positive("year")},
+                }}],
+                "makes": [{"$sortByCount": {"$ifNull": ["$make", "Unknown"]}}],
+                "models": [{"$sortByCount": {"$ifNull": ["$model", "Unknown"]}}],
+            }},
+        ]), None)
+
+        totals = result["totals"][0] if result and result["totals"] else None
+        if not totals:
             return {
                 "total_active": 0, "total_removed": 0,
                 "avg_price": 0, "avg_mileage": 0,
@@ -220,45 +379,76 @@ class Database:
                 "makes": {}, "models": {},
             }
 
-        prices = [v["price"] for v in active if v.get("price")]
-        mileages = [v["mileage"] for v in active if v.get("mileage")]
-        years = [v["year"] for v in active if v.get("year")]
-
-        makes, models = {}, {}
-        for v in active:
-            mk = v.get("make", "Unknown")
-            md = v.get("model", "Unknown")
-            makes[mk] = makes.get(mk, 0) + 1
-            models[md] = models.get(md, 0) + 1
-
         return {
-            "total_active": len(active),
+            "total_active": totals["total_active"],
             "total_removed": self.vehicles.count_documents({"status": "removed"}),
-            "avg_price": round(sum(prices) / len(prices)) if prices else 0,
-            "avg_mileage": round(sum(mileages) / len(mileages)) if mileages else 0,
-            "price_range": {"min": min(prices) if prices else 0, "max": max(prices) if prices else 0},
-            "year_range": {"min": min(years) if years else 0, "max": max(years) if years else 0},
-            "makes": makes,
-            "models": models,
+            "avg_price": round(totals["avg_price"] or 0),
+            "avg_mileage": round(totals["avg_mileage"] or 0),
+            "price_range": {"min": totals["min_price"] or 0, "max": totals["max_price"] or 0},
+            "year_range": {"min": totals["min_year"] or 0, "max": totals["max_year"] or 0},
+            "makes": {m["_id"]: m["count"] for m in result["makes"]},
+            "models": {m["_id"]: m["count"] for m in result["models"]},
         }
 
     def update_predicted_prices(self, predictions: dict):
-        """Batch-update predicted prices. Pre-fetch actual prices to avoid N+1 queries."""
-        # grab all actual prices in one query
-        vins = list(predictions.keys())
-        price_map = {}
-        for doc in self.vehicles.find({"vin": {"$in": vins}}, {"vin": 1, "price": 1}):
-            price_map[doc["vin"]] = doc.get("price", 0)
-
-        for vin, predicted in predictions.items():
-            actual = price_map.get(vin, predicted)
-            self.vehicles.update_one(
-                {"vin": vin},
-                {"$set": {
-                    "predicted_price": round(predicted),
-                    "price_difference": round(predicted - actual),
-                }}
-            )
+        """
+        Write predictions to a staging collection, then let one server-side
+        $lookup + $merge pass compute price_difference and update vehicles.
+        """
+        if not predictions:
+            return
+        self.predictions_staging.drop()
+        self.predictions_staging.insert_many(
+            [{"vin": vin, "predicted_price": round(p)} for vin, p in predictions.items()],
+            ordered=False,
+        )
+        self.predictions_staging.aggregate([
+            {"$lookup": {
+                "from": self.vehicles.name, "localField": "vin",
+                "foreignField": "vin", "as": "vehicle",
+            }},
+            {"$project": {
+                "_id": 0,
+                "vin": 1,
+                "predicted_price": 1,
+                "price_difference": {"$subtract": [
+                    "$predicted_price",
+                    {"$ifNull": [{"$arrayElemAt": ["$vehicle.price", 0]}, 0]},
+                ]},
+            }},
+            {"$merge": {
+                "into": self.vehicles.name, "on": "vin",
+                "whenMatched": "merge", "whenNotMatched": "discard",
+            }},
+        ])
+        self.predictions_staging.drop()
+
+    # ── ML model storage ──────────────────────────────────────────────
+
+    def save_model(self, model_data: bytes, **fields):
+        """Store serialized model bytes in GridFS; the model doc keeps only a file_id."""
+        file_id = self.model_files.put(model_data, filename="price_predictor.joblib")
+        previous = self.models.find_one_and_update(
+            {"type": "price_predictor"},
+            {"$set": {"type": "price_predictor", "file_id": file_id, **fields},
+             "$unset": {"model_data": ""}},
+            upsert=True,
+        )
+        if previous and previous.get("file_id"):
+            self.model_files.delete(previous["file_id"])
+
+    def load_model(self):
+        """Return a readable stream of the latest saved model, or None."""
+        model_doc = self.models.find_one(
+            {"type": "price_predictor"},
+            sort=[("timestamp", DESCENDING)],
+        )
+        if not model_doc:
+            return None
+        if "file_id" in model_doc:
+            return self.model_files.get(model_doc["file_id"])
+        # legacy docs embedded the pickle directly
+        return model_doc.get("model_data")
 
     def close(self):
         self.client.close()
@@ -0,0 +1,13 @@
+"""
+Server entry point: `python main.py`.
+
+Kept separate from app.py so uvicorn can import "app:app" exactly once per
+worker. Running app.py itself as a script would load it a second time as
+__main__, registering its routes and lifespan twice on the shared FastAPI app.
+"""
+import uvicorn
+
+from config import API_HOST, API_PORT, API_WORKERS
+
+if __name__ == "__main__":
+    uvicorn.run("app:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
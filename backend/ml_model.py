@@ -1,37 +1,103 @@
+import functools
+import io
 import logging
-import pickle
+import joblib
 import numpy as np
-import pandas as pd
 from datetime import datetime, timezone
-from typing import Optional
-from sklearn.model_selection import cross_val_score, train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from typing import TYPE_CHECKING, Optional
+
+# pandas and sklearn are imported where they're used, so importing this module
+# (the API process, a predict-only worker) doesn't pay their startup cost
+if TYPE_CHECKING:
+    import pandas as pd
 
 from config import MIN_SAMPLES_FOR_TRAINING, TEST_SIZE, RANDOM_STATE, CV_FOLDS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CATEGORICAL_COLUMNS = ["make", "model", "trim", "fuel_type",
+                       "transmission", "drivetrain", "body_style"]
+FEATURE_COLUMNS = ["year", "mileage", "vehicle_age", "mileage_bin",
+                   *(f"{col}_encoded" for col in CATEGORICAL_COLUMNS)]
+# right-closed mileage bins: (0, 20k], (20k, 50k], ... (200k, inf); 0 falls in bin 0
+MILEAGE_BIN_EDGES = np.array([0, 20000, 50000, 80000, 120000, 200000, np.inf])
+# histogram-binned models split on quantiles, so they are fit on raw features
+UNSCALED_MODELS = {"Hist Gradient Boosting"}
+
+
+def _mileage_bins(mileage):
+    """pd.cut(MILEAGE_BIN_EDGES, include_lowest=True) codes via one binary search.
+
+    side="left" keeps the bins right-closed so codes match the ones training saw.
+    """
+    return np.clip(np.searchsorted(MILEAGE_BIN_EDGES, mileage, side="left") - 1, 0, 5)
+
+
+def _feature_kernel(years, mileages, codes, current_year, edges):
+    """Assemble FEATURE_COLUMNS rows from numeric columns and pre-resolved category codes."""
+    n, n_codes = codes.shape
+    X = np.empty((n, 4 + n_codes), dtype=np.float32)
+    for i in range(n):
+        X[i, 0] = years[i]
+        X[i, 1] = mileages[i]
+        X[i, 2] = current_year - years[i]
+        X[i, 3] = min(max(np.searchsorted(edges, mileages[i]) - 1, 0), 5)
+        for j in range(n_codes):
+            X[i, 4 + j] = codes[i, j]
+    return X
+
+
+@functools.cache
+def _jit_feature_kernel():
+    """_feature_kernel compiled with Numba, or None when Numba isn't installed."""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(cache=True)(_feature_kernel)
+
+
+def _fit_one(name, model, X_train, y_train, X_test):
+    """Fit one candidate and predict the test split. Runs in a joblib worker."""
+    logger.info(f"Training {name}...")
+    try:
+        model.fit(X_train, y_train)
+        return name, model, model.predict(X_test), None
+    except Exception as e:
+        return name, model, None, e
+
 
 class VehiclePricePredictor:
     """Trains multiple regression models, picks the best one, and predicts vehicle prices."""
 
-    def __init__(self):
+    def __init__(self, as_of_year: Optional[int] = None):
         self.models = {}
         self.best_model = None
         self.best_model_name = ""
-        self.label_encoders = {}
-        self.scaler = StandardScaler()
+        self.categories = {}  # col -> category labels frozen at fit time; code = position
+        self._cat_maps = {}  # col -> {label: code}, mirrors categories
+        self.scaler = None  # fit in train(), restored by deserialize()
         self.feature_columns = []
         self.metrics = {}
         self.is_trained = False
         self.training_timestamp = None
+        # reference year for vehicle_age: fixed when train() runs and saved with the
+        # model, so every copy of it computes the same ages (as_of_year pins it)
+        self._as_of_year = as_of_year
+        self._reference_year = as_of_year
+
+    def _set_categories(self, col: str, labels: list) -> None:
+        self.categories[col] = labels
+        self._cat_maps[col] = {c: i for i, c in enumerate(labels)}
 
-    def prepare_features(self, vehicles: list[dict], for_prediction=False) -> Optional[pd.DataFrame]:
+    def _model_input(self, name: str, X: np.ndarray) -> np.ndarray:
+        return X if name in UNSCALED_MODELS else self.scaler.transform(X)
+
+    def prepare_features(self, vehicles: list[dict], for_prediction=False) -> Optional["pd.DataFrame"]:
         """Convert raw vehicle dicts into ML-ready features."""
+        import pandas as pd
+
         if not vehicles:
             return None
 
@@ -58,29 +124,30 @@ class VehiclePricePredictor:
             return None
 
         # feature engineering
-        current_year = datetime.now().year
-        df["vehicle_age"] = current_year - df["year"]
+        df["vehicle_age"] = self._reference_year - df["year"]
         df["price_per_km"] = df["price"] / df["mileage"].clip(lower=1)
-        df["mileage_bin"] = pd.cut(
-            df["mileage"],
-            bins=[0, 20000, 50000, 80000, 120000, 200000, float("inf")],
-            labels=[0, 1, 2, 3, 4, 5],
-        ).astype(int)
+        if for_prediction:
+            df["mileage_bin"] = _mileage_bins(df["mileage"].to_numpy()).astype(np.int8)
+        else:
+            # labels=False yields integer bin codes directly (no Categorical)
+            df["mileage_bin"] = pd.cut(
+                df["mileage"],
+                bins=MILEAGE_BIN_EDGES,
+                labels=False,
+                include_lowest=True,
+            ).astype(np.int8)
 
         # encode categoricals
-        cat_cols = ["make", "model", "trim", "fuel_type",
-                    "transmission", "drivetrain", "body_style"]
-        for col in cat_cols:
+        for col in CATEGORICAL_COLUMNS:
             if col in df.columns:
                 df[col] = df[col].fillna("Unknown").astype(str)
-                if col not in self.label_encoders:
-                    self.label_encoders[col] = LabelEncoder()
-                    df[f"{col}_encoded"] = self.label_encoders[col].fit_transform(df[col])
-                else:
-                    le = self.label_encoders[col]
-                    df[f"{col}_encoded"] = df[col].apply(
-                        lambda x, _le=le: _le.transform([x])[0] if x in _le.classes_ else -1
-                    )
+                if col not in self.categories:
+                    # sorted, as LabelEncoder ordered its classes
+                    self._set_categories(col, sorted(df[col].unique()))
+                # one hash lookup per column; unseen labels get code -1
+                df[f"{col}_encoded"] = pd.Categorical(
+                    df[col], categories=self.categories[col]
+                ).codes.astype(np.int32)
             else:
                 df[f"{col}_encoded"] = 0
 
@@ -88,43 +155,53 @@ class VehiclePricePredictor:
 
     def train(self, vehicles: list[dict]) -> dict:
         """Train all models, evaluate, pick the best."""
+        from sklearn.model_selection import cross_validate, train_test_split
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.linear_model import LinearRegression
+        from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+        from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
         logger.info(f"Starting model training with {len(vehicles)} vehicles")
+        self._reference_year = self._as_of_year or datetime.now(timezone.utc).year
 
         df = self.prepare_features(vehicles)
         if df is None:
             return {"error": "Insufficient data for training"}
 
-        self.feature_columns = [
-            "year", "mileage", "vehicle_age", "mileage_bin",
-            "make_encoded", "model_encoded", "trim_encoded",
-            "fuel_type_encoded", "transmission_encoded",
-            "drivetrain_encoded", "body_style_encoded",
-        ]
+        self.feature_columns = list(FEATURE_COLUMNS)
 
         for col in self.feature_columns:
             if col not in df.columns:
                 df[col] = 0
 
-        X = df[self.feature_columns].values
-        y = df["price"].values
+        # single precision halves the matrix the tree ensembles scan
+        X = df[self.feature_columns].to_numpy(dtype=np.float32)
+        y = df["price"].to_numpy(dtype=np.float32)
 
         # split FIRST, then fit scaler on train only (prevents data leakage)
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE
         )
+        self.scaler = StandardScaler()
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
-        X_all_scaled = self.scaler.transform(X)
+
+        # small inventories don't need 100 trees; XGBoost keeps its full 100 rounds
+        n_est = min(100, max(30, len(X_train) // 5))
+        min_leaf = max(2, len(X_train) // 200)
+        logger.info(f"Ensemble size: n_estimators={n_est}, RF min_samples_leaf={min_leaf}")
 
         # models to compare
         configs = {
             "Linear Regression": LinearRegression(),
             "Random Forest": RandomForestRegressor(
-                n_estimators=100, random_state=RANDOM_STATE, n_jobs=-1,
+                n_estimators=n_est, min_samples_leaf=min_leaf,
+                random_state=RANDOM_STATE, n_jobs=-1,
             ),
-            "Gradient Boosting": GradientBoostingRegressor(
-                n_estimators=100, learning_rate=0.1, max_depth=4,
-                random_state=RANDOM_STATE,
+            "Hist Gradient Boosting": HistGradientBoostingRegressor(
+                max_iter=n_est, learning_rate=0.1, max_depth=4,
+                early_stopping=True, random_state=RANDOM_STATE,
             ),
         }
 
@@ -141,19 +218,38 @@ class VehiclePricePredictor:
         results = {}
         best_r2 = -float("inf")
 
-        for name, model in configs.items():
-            logger.info(f"Training {name}...")
+        # independent fits overlap (LR/HGB/XGBoost leave cores idle next to RF);
+        # threads, since the estimators release the GIL in their inner loops.
+        # results come back in config order, so best-model ties resolve as before
+        fitted = joblib.Parallel(n_jobs=len(configs), prefer="threads")(
+            joblib.delayed(_fit_one)(
+                name, model,
+                X_train if name in UNSCALED_MODELS else X_train_scaled, y_train,
+                X_test if name in UNSCALED_MODELS else X_test_scaled,
+            )
+            for name, model in configs.items()
+        )
+
+        for name, model, y_pred, fit_error in fitted:
+            if fit_error is not None:
+                logger.error(f"Error training {name}: {fit_error}")
+                results[name] = {"error": str(fit_error)}
+                continue
             try:
-                model.fit(X_train_scaled, y_train)
-                y_pred = model.predict(X_test_scaled)
+                unscaled = name in UNSCALED_MODELS
 
-                mae = mean_absolute_error(y_test, y_pred)
-                rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-                r2 = r2_score(y_test, y_pred)
+                # float32 inputs give numpy float32 metrics; cast for BSON/JSON
+                mae = float(mean_absolute_error(y_test, y_pred))
+                rmse = float(np.sqrt(mean_squared_error(y_test, y_pred)))
+                r2 = float(r2_score(y_test, y_pred))
 
-                cv_folds = min(CV_FOLDS, len(X_all_scaled))
+                # scaler is refit inside each fold (no leakage); folds run in parallel
+                cv_folds = min(CV_FOLDS, len(X))
                 if cv_folds >= 2:
-                    cv = cross_val_score(model, X_all_scaled, y, cv=cv_folds, scoring="r2")
+                    cv = cross_validate(
+                        model if unscaled else make_pipeline(StandardScaler(), model), X, y,
+                        cv=cv_folds, scoring="r2", n_jobs=-1,
+                    )["test_score"]
                     cv_mean, cv_std = cv.mean(), cv.std()
                 else:
                     cv_mean, cv_std = r2, 0.0
@@ -195,21 +291,44 @@ class VehiclePricePredictor:
             "timestamp": self.training_timestamp.isoformat(),
         }
 
+    def _prepare_row(self, vehicle: dict) -> Optional[np.ndarray]:
+        """
+        Single-vehicle fast path matching prepare_features(for_prediction=True),
+        without building a DataFrame. Returns a (1, n_features) array.
+        """
+        if "year" not in vehicle or "mileage" not in vehicle:
+            return None
+
+        year = vehicle["year"] if vehicle["year"] is not None else 2020
+        mileage = vehicle["mileage"] or 0
+        features = {
+            "year": year,
+            "mileage": mileage,
+            "vehicle_age": self._reference_year - year,
+            "mileage_bin": _mileage_bins(mileage),
+        }
+        for col in CATEGORICAL_COLUMNS:
+            if col not in vehicle or col not in self._cat_maps:
+                code = 0
+            else:
+                val = vehicle[col]
+                code = self._cat_maps[col].get("Unknown" if val is None else str(val), -1)
+            features[f"{col}_encoded"] = code
+
+        return np.fromiter(
+            (features.get(col, 0) for col in self.feature_columns),
+            dtype=np.float32, count=len(self.feature_columns),
+        ).reshape(1, -1)
+
     def predict(self, vehicle: dict) -> Optional[dict]:
         if not self.is_trained:
             return None
 
-        df = self.prepare_features([vehicle], for_prediction=True)
-        if df is None or len(df) == 0:
+        X = self._prepare_row(vehicle)
+        if X is None:
             return None
 
-        for col in self.feature_columns:
-            if col not in df.columns:
-                df[col] = 0
-
-        X = df[self.feature_columns].values
-        X_scaled = self.scaler.transform(X)
-        predicted = self.best_model.predict(X_scaled)[0]
+        predicted = float(self.best_model.predict(self._model_input(self.best_model_name, X))[0])
 
         actual = vehicle.get("price", 0)
         diff = round(predicted - actual) if actual else None
@@ -223,14 +342,61 @@ class VehiclePricePredictor:
         }
 
     def predict_batch(self, vehicles: list[dict]) -> dict:
-        predictions = {}
-        for v in vehicles:
-            vin = v.get("vin")
-            if vin:
-                result = self.predict(v)
-                if result:
-                    predictions[vin] = result["predicted_price"]
-        return predictions
+        """Predict every vehicle with a VIN in one pass. Returns {vin: price}.
+
+        Features come from the Numba kernel when Numba is installed, else from prepare_features.
+        """
+        if not self.is_trained:
+            return {}
+
+        vehicles = [v for v in vehicles if v.get("vin")]
+        kernel = _jit_feature_kernel()
+        if kernel is not None and self._jit_compatible():
+            X = self._batch_features_jit(kernel, vehicles)
+            if X is None:
+                return {}
+            vins = [v["vin"] for v in vehicles]
+        else:
+            df = self.prepare_features(vehicles, for_prediction=True)
+            if df is None or len(df) == 0:
+                return {}
+
+            for col in self.feature_columns:
+                if col not in df.columns:
+                    df[col] = 0
+            X = df[self.feature_columns].to_numpy(dtype=np.float32)
+            vins = df["vin"]
+
+        predicted = self.best_model.predict(self._model_input(self.best_model_name, X))
+        return {vin: round(float(p)) for vin, p in zip(vins, predicted)}
+
+    def _jit_compatible(self) -> bool:
+        # models saved with a different feature layout go through prepare_features
+        return (self.feature_columns == FEATURE_COLUMNS
+                and all(col in self._cat_maps for col in CATEGORICAL_COLUMNS))
+
+    def _batch_features_jit(self, kernel, vehicles: list[dict]) -> Optional[np.ndarray]:
+        """Same features as prepare_features(for_prediction=True), built without pandas."""
+        keys = set().union(*vehicles)
+        if "year" not in keys or "mileage" not in keys:
+            return None
+
+        n = len(vehicles)
+        years = np.fromiter(
+            (2020 if v.get("year") is None else v["year"] for v in vehicles),
+            dtype=np.float64, count=n,
+        )
+        mileages = np.fromiter((v.get("mileage") or 0 for v in vehicles), dtype=np.float64, count=n)
+        # a column no vehicle carries encodes as 0, a missing value as "Unknown"
+        codes = np.zeros((n, len(CATEGORICAL_COLUMNS)), dtype=np.float32)
+        for j, col in enumerate(CATEGORICAL_COLUMNS):
+            if col in keys:
+                classes = self._cat_maps[col]
+                codes[:, j] = [
+                    classes.get("Unknown" if (val := v.get(col)) is None else str(val), -1)
+                    for v in vehicles
+                ]
+        return kernel(years, mileages, codes, self._reference_year, MILEAGE_BIN_EDGES)
 
     def _get_feature_importance(self) -> dict:
         if not self.best_model:
@@ -252,27 +418,43 @@ class VehiclePricePredictor:
         return importance
 
     def serialize(self) -> bytes:
-        return pickle.dumps({
+        buf = io.BytesIO()
+        joblib.dump({
             "best_model": self.best_model,
             "best_model_name": self.best_model_name,
             "models": self.models,
-            "label_encoders": self.label_encoders,
+            "categories": self.categories,
             "scaler": self.scaler,
             "feature_columns": self.feature_columns,
             "metrics": self.metrics,
             "training_timestamp": self.training_timestamp,
-        })
+            "reference_year": self._reference_year,
+        }, buf, compress=("lz4", 3), protocol=5)
+        return buf.getvalue()
 
-    def deserialize(self, data: bytes):
-        loaded = pickle.loads(data)
+    def deserialize(self, data):
+        """Load from bytes or a readable file object (e.g. a GridFS stream).
+
+        joblib also reads plain pickles, so models saved before the switch still load.
+        """
+        loaded = joblib.load(io.BytesIO(data) if isinstance(data, bytes) else data)
         self.best_model = loaded["best_model"]
         self.best_model_name = loaded["best_model_name"]
         self.models = loaded["models"]
-        self.label_encoders = loaded["label_encoders"]
+        # models saved before the switch to pd.Categorical carry fitted LabelEncoders
+        if "categories" in loaded:
+            categories = loaded["categories"]
+        else:
+            categories = {col: le.classes_.tolist() for col, le in loaded["label_encoders"].items()}
+        self.categories, self._cat_maps = {}, {}
+        for col, labels in categories.items():
+            self._set_categories(col, labels)
         self.scaler = loaded["scaler"]
         self.feature_columns = loaded["feature_columns"]
         self.metrics = loaded["metrics"]
         self.training_timestamp = loaded["training_timestamp"]
+        # older bundles predate the stored year; they were trained in their timestamp's year
+        self._reference_year = loaded.get("reference_year") or self.training_timestamp.year
         self.is_trained = True
         logger.info(f"Model loaded: {self.best_model_name} (trained at {self.training_timestamp})")
 
@@ -286,3 +468,30 @@ class VehiclePricePredictor:
             "feature_importance": self._get_feature_importance(),
             "training_timestamp": self.training_timestamp.isoformat() if self.training_timestamp else None,
         }
+
+
+# ── Worker-process entry points ──────────────────────────────────────
+# Module-level so they pickle cleanly into a ProcessPoolExecutor. Models
+# travel between processes in their serialized form.
+
+def warm_up() -> None:
+    """Run early in a sync so the worker's startup and heavy imports overlap the scrape."""
+    import pandas  # noqa: F401
+    import sklearn.ensemble  # noqa: F401
+    import sklearn.model_selection  # noqa: F401
+
+
+def train_model(vehicles: list[dict]) -> tuple[dict, Optional[bytes]]:
+    """Train a fresh predictor. Returns (training result, serialized model or None)."""
+    predictor = VehiclePricePredictor()
+    # no loky processes under the executor worker: they outlive train() and
+    # hold up the worker's exit (and ml_executor.shutdown) until loky's idle timeout
+    with joblib.parallel_config(backend="threading"):
+        result = predictor.train(vehicles)
+    return result, predictor.serialize() if predictor.is_trained else None
+
+
+def predict_with_model(model_data: bytes, vehicles: list[dict]) -> dict:
+    predictor = VehiclePricePredictor()
+    predictor.deserialize(model_data)
+    return predictor.predict_batch(vehicles)
@@ -10,13 +10,74 @@ import re
 import logging
 from datetime import datetime, timezone
 from typing import Optional
-from playwright.async_api import async_playwright, Page, Browser
+from playwright.async_api import async_playwright, Page, Browser, Route
 
 from config import TARGET_URL, BASE_URL, SCRAPE_TIMEOUT, PAGE_LOAD_WAIT
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ── Card parsing patterns (compiled once) ───────────────────────────
+
+# stock/mileage/price/year lines are matched in the browser (_extract_card_data);
+# these only run on the trim line it hands back
+_AUTOMATIC_RE = re.compile(r"tiptronic|s.tronic|automatique", re.IGNORECASE)
+_MANUAL_RE = re.compile(r"manuelle|manual", re.IGNORECASE)
+_QUATTRO_RE = re.compile(r"quattro", re.IGNORECASE)
+_GASOLINE_RE = re.compile(r"TFSI|TSI|FSI")
+_DIESEL_RE = re.compile(r"TDI")
+_ELECTRIC_RE = re.compile(r"e-tron", re.IGNORECASE)
+_ENGINE_RE = re.compile(r"(\d{2,3}\s*(?:TFSI|TDI|TSI|e-tron))")
+
+NON_AUDI_MAKES = {
+    "BMW": "BMW", "Mercedes-Benz": "Mercedes-Benz",
+    "Mercedes": "Mercedes-Benz", "Porsche": "Porsche",
+    "Volkswagen": "Volkswagen", "VW": "Volkswagen",
+    "Toyota": "Toyota", "Honda": "Honda", "Lexus": "Lexus",
+    "Acura": "Acura", "Infiniti": "Infiniti",
+    "Land Rover": "Land Rover", "Range Rover": "Land Rover",
+    "Jaguar": "Jaguar", "Volvo": "Volvo",
+    "Genesis": "Genesis", "Hyundai": "Hyundai",
+    "Kia": "Kia", "Mazda": "Mazda", "Subaru": "Subaru",
+    "Ford": "Ford", "Chevrolet": "Chevrolet", "GMC": "GMC",
+    "Jeep": "Jeep", "Dodge": "Dodge", "Ram": "Ram",
+    "Tesla": "Tesla", "Nissan": "Nissan",
+    "Mitsubishi": "Mitsubishi", "Lincoln": "Lincoln",
+    "Cadillac": "Cadillac", "Buick": "Buick",
+    "Chrysler": "Chrysler", "Vinfast": "Vinfast",
+}
+# alternation keeps dict order, so "Mercedes-Benz" wins over "Mercedes"
+_NON_AUDI_RE = re.compile("|".join(map(re.escape, NON_AUDI_MAKES)), re.IGNORECASE)
+# matched key (lowercased) -> (brand, pattern that strips that key from the text)
+_NON_AUDI_BY_KEY = {
+    key.lower(): (brand, re.compile(re.escape(key), re.IGNORECASE))
+    for key, brand in NON_AUDI_MAKES.items()
+}
+
+# ordered longest-first: at each position the alternation tries them in this
+# order, so "Q5 Sportback" matches before "Q5"
+AUDI_MODELS = [
+    "Q8 Sportback e-tron", "Q8 e-tron", "Q4 Sportback e-tron",
+    "Q4 e-tron", "Q5 Sportback", "Q3 Sportback",
+    "e-tron GT", "e-tron S Sportback", "e-tron Sportback",
+    "e-tron", "RS Q8", "RS Q3",
+    "RS7", "RS6", "RS5", "RS4", "RS3",
+    "SQ8", "SQ7", "SQ5", "SQ3",
+    "S8", "S7", "S6", "S5", "S4", "S3",
+    "Q8", "Q7", "Q6 e-tron", "Q5", "Q4", "Q3", "Q2",
+    "A8", "A7", "A6", "A5", "A4", "A3", "A1",
+    "TT RS", "TT", "R8",
+]
+_AUDI_MODEL_RE = re.compile("|".join(map(re.escape, AUDI_MODELS)), re.IGNORECASE)
+_AUDI_MODEL_BY_KEY = {m.lower(): m for m in AUDI_MODELS}
+
+# stylesheets stay: innerText line breaks depend on layout
+_BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+# rendered vehicle links; the site shows one per VIN, so the count is a plain
+# length read (duplicates are dropped once, in _extract_card_data)
+_VEHICLE_COUNT_JS = """() => document.querySelectorAll('a[href*="vehicleId"]').length"""
+
 
 class AudiWestIslandScraper:
     def __init__(self):
@@ -42,6 +103,8 @@ class AudiWestIslandScraper:
                     "Chrome/121.0.0.0 Safari/537.36"
                 ),
             )
+            # cards are read from the DOM, so skip downloading what only paints pixels
+            await context.route("**/*", self._block_heavy_resources)
             page = await context.new_page()
 
             try:
@@ -55,6 +118,13 @@ class AudiWestIslandScraper:
                 await context.close()
                 await self.browser.close()
 
+    @staticmethod
+    async def _block_heavy_resources(route: Route):
+        if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
     async def _scrape_listing_page(self, page: Page) -> list[dict]:
         logger.info(f"Navigating to {self.inventory_url}")
         await page.goto(self.inventory_url, wait_until="domcontentloaded", timeout=SCRAPE_TIMEOUT)
@@ -79,36 +149,34 @@ class AudiWestIslandScraper:
 
     async def _load_all_vehicles(self, page: Page):
         """Keep clicking 'Load More' until no new vehicles appear."""
-        prev_count = 0
+        btn = page.locator(
+            'button:has-text("Afficher plus"), '
+            'button:has-text("plus de"), '
+            'button:has-text("Load More"), '
+            '[class*="LoadMore"], '
+            '[class*="load-more"]'
+        )
+        prev_count = await page.evaluate(_VEHICLE_COUNT_JS)
         for attempt in range(30):
             await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            await page.wait_for_timeout(1000)
 
             try:
-                btn = page.locator(
-                    'button:has-text("Afficher plus"), '
-                    'button:has-text("plus de"), '
-                    'button:has-text("Load More"), '
-                    '[class*="LoadMore"], '
-                    '[class*="load-more"]'
-                )
-                if await btn.count() > 0:
-                    await btn.first.click()
-                    await page.wait_for_timeout(2500)
-                else:
-                    break
+                # returns as soon as the button is in the DOM; times out when it's gone
+                await btn.first.wait_for(state="attached", timeout=1000)
+                await btn.first.click()
             except Exception:
                 break
 
-            count = await page.evaluate("""() => {
-                const seen = new Set();
-                document.querySelectorAll('a[href*="vehicleId"]')
-                    .forEach(a => {
-                        const m = a.href.match(/vehicleId=([A-Z0-9]+)/i);
-                        if (m) seen.add(m[1]);
-                    });
-                return seen.size;
-            }""")
+            # proceed as soon as the new cards render instead of sleeping a fixed 2.5s
+            try:
+                await page.wait_for_function(
+                    f"prev => ({_VEHICLE_COUNT_JS})() > prev",
+                    arg=prev_count, timeout=10000,
+                )
+            except Exception:
+                await page.wait_for_timeout(1000)
+
+            count = await page.evaluate(_VEHICLE_COUNT_JS)
 
             logger.info(f"Load attempt {attempt + 1}: {count} vehicles")
             if count == prev_count:
@@ -118,8 +186,37 @@ class AudiWestIslandScraper:
         logger.info(f"All vehicles loaded: {prev_count} total")
 
     async def _extract_card_data(self, page: Page) -> list[dict]:
-        """Pull VIN, listing URL, and card text from every vehicle card on the page."""
+        """
+        Pull VIN, listing URL, and the card's structured fields from every vehicle card.
+
+        Line classification runs in the browser so only the parsed fields cross
+        back, not every card's full innerText. Expected card format:
+
+            N de stock #: U6214
+            Maintenant Disponible
+            2022 Audi Q3 SUV
+            Technik 45 TFSI tiptronic
+            Kilometrage: 71,063 km
+            Prix final
+            33 795,00 $
+        """
         return await page.evaluate("""() => {
+            const STOCK = /stock\\s*#?\\s*:?\\s*([A-Z0-9]+)/i;
+            const KM = /[Kk]ilom[eé]trage\\s*:?\\s*([\\d\\s,.]+)\\s*km/;
+            const PRICE = /([\\d\\s\\u202f]+(?:[.,]\\d{2})?)\\s*\\$/;
+            const YEAR_LINE = /^(20[1-2]\\d)\\s+(.+)/;
+            const YEAR = /^20[1-2]\\d/;
+            const DIGITS = /^\\d+$/;
+            const NOT_TRIM = new Set([
+                'Maintenant Disponible',
+                'Disponible dès maintenant',
+                'Prix final',
+                "Afficher les détails du véhicule",
+                'Réserver un essai routier',
+                "Demander plus d'informations",
+                'Calculez mes paiements',
+            ]);
+
             const results = [];
             const seen = new Set();
             const links = document.querySelectorAll('a[href*="vehicleId"]');
@@ -140,37 +237,69 @@ class AudiWestIslandScraper:
                     if (cls.includes('VehicleCard')) break;
                 }
 
-                results.push({
+                const row = {
                     vin: vin,
                     listing_url: href,
-                    card_text: card.innerText || '',
-                });
+                    stock_number: '',
+                    mileage: null,
+                    price: null,
+                    year: null,
+                    title: '',
+                    model_line: '',
+                    trim: '',
+                };
+
+                for (const raw of (card.innerText || '').split('\\n')) {
+                    const line = raw.trim();
+                    if (!line) continue;
+                    let m;
+
+                    if ((m = STOCK.exec(line))) {
+                        if (!row.stock_number) row.stock_number = m[1];
+                        continue;
+                    }
+                    if ((m = KM.exec(line))) {
+                        const km = m[1].replace(/[\\s,.]/g, '');
+                        if (DIGITS.test(km)) row.mileage = parseInt(km, 10);
+                        continue;
+                    }
+                    // French format: "33 795,00 $"
+                    if ((m = PRICE.exec(line))) {
+                        if (!row.price) {
+                            const digits = m[1].replace(/\\s/g, '').replace(/[.,]\\d{2}$/, '');
+                            const price = DIGITS.test(digits) ? parseInt(digits, 10) : 0;
+                            if (price > 1000 && price < 500000) row.price = price;
+                        }
+                        continue;
+                    }
+                    if ((m = YEAR_LINE.exec(line))) {
+                        if (!row.year) {
+                            row.year = parseInt(m[1], 10);
+                            row.model_line = m[2].trim();
+                            row.title = line;
+                        }
+                        continue;
+                    }
+                    // trim line (follows the year/model line)
+                    if (row.year && !row.trim && !NOT_TRIM.has(line) && !YEAR.test(line)) {
+                        row.trim = line;
+                        if (row.title) row.title += ' ' + line;
+                    }
+                }
+                results.push(row);
             });
             return results;
         }""")
 
     def _parse_card(self, raw: dict) -> dict:
-        """
-        Parse card text into structured vehicle data. Expected format:
-
-            N de stock #: U6214
-            Maintenant Disponible
-            2022 Audi Q3 SUV
-            Technik 45 TFSI tiptronic
-            Kilometrage: 71,063 km
-            Prix final
-            33 795,00 $
-        """
-        text = raw.get("card_text", "")
-        lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
+        """Build a vehicle record from the fields _extract_card_data pulled off a card."""
         vehicle = {
             "vin": raw.get("vin", ""),
-            "title": "",
-            "price": None,
-            "mileage": None,
+            "title": raw.get("title", ""),
+            "price": raw.get("price"),
+            "mileage": raw.get("mileage"),
             "mileage_unit": "km",
-            "year": None,
+            "year": raw.get("year"),
             "make": "Audi",
             "model": "",
             "trim": "",
@@ -181,88 +310,42 @@ class AudiWestIslandScraper:
             "engine": "",
             "exterior_color": "",
             "interior_color": "",
-            "stock_number": "",
+            "stock_number": raw.get("stock_number", ""),
             "listing_url": raw.get("listing_url", ""),
             "website_url": self.base_url,
             "date_scraped": self.scrape_timestamp.isoformat(),
             "status": "active",
         }
 
-        for line in lines:
-            # stock number
-            stock_match = re.search(r"stock\s*#?\s*:?\s*([A-Z0-9]+)", line, re.IGNORECASE)
-            if stock_match and not vehicle["stock_number"]:
-                vehicle["stock_number"] = stock_match.group(1)
-                continue
-
-            # mileage
-            km_match = re.search(r"[Kk]ilom[eé]trage\s*:?\s*([\d\s,.]+)\s*km", line)
-            if km_match:
-                raw_km = km_match.group(1).replace(",", "").replace(" ", "").replace("\u202f", "").replace(".", "")
-                try:
-                    vehicle["mileage"] = int(raw_km)
-                except ValueError:
-                    pass
-                continue
-
-            # price (French format: "33 795,00 $")
-            price_match = re.search(r"([\d\s\u202f]+(?:[.,]\d{2})?)\s*\$", line)
-            if price_match and not vehicle["price"]:
-                price_str = re.sub(r"[\s\u202f]", "", price_match.group(1))
-                price_str = re.sub(r"[.,]\d{2}$", "", price_str)
-                try:
-                    price = int(price_str)
-                    if 1000 < price < 500000:
-                        vehicle["price"] = price
-                except ValueError:
-                    pass
-                continue
-
-            # year + make + model line
-            year_match = re.match(r"(20[1-2]\d)\s+(.+)", line)
-            if year_match and not vehicle["year"]:
-                vehicle["year"] = int(year_match.group(1))
-                rest = year_match.group(2).strip()
-                self._parse_model_line(vehicle, rest)
-                vehicle["title"] = line
-                continue
-
-            # trim line (follows the year/model line)
-            if (vehicle["year"] and not vehicle["trim"]
-                    and line not in ["Maintenant Disponible",
-                                     "Disponible dès maintenant",
-                                     "Prix final",
-                                     "Afficher les détails du véhicule",
-                                     "Réserver un essai routier",
-                                     "Demander plus d'informations",
-                                     "Calculez mes paiements"]
-                    and not stock_match and not km_match and not price_match
-                    and not re.match(r"20[1-2]\d", line)):
-                vehicle["trim"] = line
-                if vehicle["title"]:
-                    vehicle["title"] += " " + line
-
-                # infer transmission
-                if re.search(r"tiptronic|s.tronic|automatique", line, re.IGNORECASE):
-                    vehicle["transmission"] = "Automatique"
-                elif re.search(r"manuelle|manual", line, re.IGNORECASE):
-                    vehicle["transmission"] = "Manuelle"
-
-                # infer drivetrain
-                if re.search(r"quattro", line, re.IGNORECASE):
-                    vehicle["drivetrain"] = "AWD (quattro)"
-
-                # infer fuel
-                if re.search(r"TFSI|TSI|FSI", line):
-                    vehicle["fuel_type"] = "Essence"
-                elif re.search(r"TDI", line):
-                    vehicle["fuel_type"] = "Diesel"
-                elif re.search(r"e-tron", line, re.IGNORECASE):
-                    vehicle["fuel_type"] = "Électrique"
-
-                engine_match = re.search(r"(\d{2,3}\s*(?:TFSI|TDI|TSI|e-tron))", line)
-                if engine_match:
-                    vehicle["engine"] = engine_match.group(1)
+        # make + model line, e.g. "Audi Q3 SUV"
+        if raw.get("model_line"):
+            self._parse_model_line(vehicle, raw["model_line"])
+
+        line = raw.get("trim", "")
+        if line:
+            vehicle["trim"] = line
+
+            # infer transmission
+            if _AUTOMATIC_RE.search(line):
+                vehicle["transmission"] = "Automatique"
+            elif _MANUAL_RE.search(line):
+                vehicle["transmission"] = "Manuelle"
+
+            # infer drivetrain
+            if _QUATTRO_RE.search(line):
+                vehicle["drivetrain"] = "AWD (quattro)"
+
+            # infer fuel
+            if _GASOLINE_RE.search(line):
+                vehicle["fuel_type"] = "Essence"
+            elif _DIESEL_RE.search(line):
+                vehicle["fuel_type"] = "Diesel"
+            elif _ELECTRIC_RE.search(line):
+                vehicle["fuel_type"] = "Électrique"
+
+            engine_match = _ENGINE_RE.search(line)
+            if engine_match:
+                vehicle["engine"] = engine_match.group(1)
 
         # fallback: fuel type from title
         if not vehicle["fuel_type"]:
@@ -283,55 +366,22 @@ class AudiWestIslandScraper:
 
     def _parse_model_line(self, vehicle: dict, text: str):
         """Extract make, model, body style from e.g. 'Audi Q3 SUV'."""
-        non_audi = {
-            "BMW": "BMW", "Mercedes-Benz": "Mercedes-Benz",
-            "Mercedes": "Mercedes-Benz", "Porsche": "Porsche",
-            "Volkswagen": "Volkswagen", "VW": "Volkswagen",
-            "Toyota": "Toyota", "Honda": "Honda", "Lexus": "Lexus",
-            "Acura": "Acura", "Infiniti": "Infiniti",
-            "Land Rover": "Land Rover", "Range Rover": "Land Rover",
-            "Jaguar": "Jaguar", "Volvo": "Volvo",
-            "Genesis": "Genesis", "Hyundai": "Hyundai",
-            "Kia": "Kia", "Mazda": "Mazda", "Subaru": "Subaru",
-            "Ford": "Ford", "Chevrolet": "Chevrolet", "GMC": "GMC",
-            "Jeep": "Jeep", "Dodge": "Dodge", "Ram": "Ram",
-            "Tesla": "Tesla", "Nissan": "Nissan",
-            "Mitsubishi": "Mitsubishi", "Lincoln": "Lincoln",
-            "Cadillac": "Cadillac", "Buick": "Buick",
-            "Chrysler": "Chrysler", "Vinfast": "Vinfast",
-        }
-
-        for key, brand in non_audi.items():
-            if key.lower() in text.lower():
-                vehicle["make"] = brand
-                text = re.sub(re.escape(key), "", text, flags=re.IGNORECASE).strip()
-                break
-
-        if text.lower().startswith("audi"):
+        brand_match = _NON_AUDI_RE.search(text)
+        if brand_match:
+            brand, key_re = _NON_AUDI_BY_KEY[brand_match.group(0).lower()]
+            vehicle["make"] = brand
+            text = key_re.sub("", text).strip()
+
+        # only the 4-char prefix needs case-folding, not the whole line
+        if text[:4].lower() == "audi":
             text = text[4:].strip()
 
-        # ordered longest-first so "Q5 Sportback" matches before "Q5"
-        audi_models = [
-            "Q8 Sportback e-tron", "Q8 e-tron", "Q4 Sportback e-tron",
-            "Q4 e-tron", "Q5 Sportback", "Q3 Sportback",
-            "e-tron GT", "e-tron S Sportback", "e-tron Sportback",
-            "e-tron", "RS Q8", "RS Q3",
-            "RS7", "RS6", "RS5", "RS4", "RS3",
-            "SQ8", "SQ7", "SQ5", "SQ3",
-            "S8", "S7", "S6", "S5", "S4", "S3",
-            "Q8", "Q7", "Q6 e-tron", "Q5", "Q4", "Q3", "Q2",
-            "A8", "A7", "A6", "A5", "A4", "A3", "A1",
-            "TT RS", "TT", "R8",
-        ]
-
-        for m in audi_models:
-            if m.lower() in text.lower():
-                vehicle["model"] = m
-                idx = text.lower().find(m.lower())
-                remainder = text[idx + len(m):].strip()
-                if remainder and remainder.lower() not in ["", "suv"]:
-                    vehicle["body_style"] = remainder
-                break
+        model_match = _AUDI_MODEL_RE.search(text)
+        if model_match:
+            vehicle["model"] = _AUDI_MODEL_BY_KEY[model_match.group(0).lower()]
+            remainder = text[model_match.end():].strip()
+            if remainder and remainder.lower() != "suv":
+                vehicle["body_style"] = remainder
 
         # infer body style from model name
         if not vehicle["body_style"]: